@@ -1,12 +1,34 @@
 import streamlit as st
-import pdfplumber
-import pptx
 import google.generativeai as genai
 import json
+import asyncio
+import threading
+import queue
+import time
 import re
+import textwrap
+import datetime
+import hashlib
+import io
+import os
 import urllib.parse
+import zipfile
+import logging
+from typing import TypedDict
+from diskcache import Cache
+import fastjsonschema
+import ijson
+from google.api_core import exceptions as google_exceptions
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+# orjson parses straight to dicts in Rust; its errors subclass ValueError like json's
+try:
+    from orjson import loads as parse_json
+except ImportError:
+    from json import loads as parse_json
 
 # --- CONFIGURATION ---
+logger = logging.getLogger(__name__)
 st.set_page_config(page_title="Eureka Pitch Scorer", layout="wide")
 
 # --- 1. AUTHENTICATION ---
@@ -22,7 +44,7 @@ RUBRIC_GUIDE = """
 CASE STUDY ANCHORS (Use these to grade):
 
 1. PROBLEM IDENTIFICATION ("Why you?")
-   ⭐ 1 STAR (BAD): "We are passionate students who love music." 
+   ⭐ 1 STAR (BAD): "We are passionate students who love music."
    (Reasoning: Generic passion, no unique leverage.)
    ⭐ 3 STAR (GOOD): "Our CTO holds a patent in audio signal processing and I managed a $2M inventory at Guitar Center."
    (Reasoning: Specific, verifiable, relevant domain expertise.)
@@ -59,140 +81,691 @@ SECTION 2: DISCOVERY
 """
 
 # --- 3. HELPER FUNCTIONS ---
-def extract_text(file, file_type):
-    text = ""
+# The parsers are imported where they're used, so a cold start doesn't pay
+# for pdfplumber, pypdfium2 and python-pptx before anyone uploads a deck.
+
+# The Judge only ever sees ~7.5k tokens (roughly 30k chars, see trim_deck),
+# so parsing stops a little past that
+TEXT_LIMIT = 35000
+
+def join_until_limit(texts):
+    parts, n = [], 0
+    for t in texts:
+        parts.append(t)
+        n += len(t) + 1
+        if n >= TEXT_LIMIT:
+            break
+    return "\n".join(parts)
+
+# PDFium (Chromium's C++ PDF engine) dumps page text many times faster than
+# pdfplumber, and the Judge never uses pdfplumber's layout info anyway.
+# It isn't thread-safe, and every session's script runs in its own thread,
+# so all PDFium work in the process goes through one lock.
+@st.cache_resource
+def get_pdfium_lock():
+    return threading.Lock()
+
+def extract_pdf_text_pdfium(file):
+    import pypdfium2 as pdfium
+    with get_pdfium_lock():
+        pdf = pdfium.PdfDocument(file.getvalue())
+        pages = iter_pdfium_text(pdf)
+        try:
+            return join_until_limit(pages)
+        finally:
+            # Close the generator here, not at garbage collection, so its
+            # page cleanup also runs under the lock
+            pages.close()
+            pdf.close()
+
+def iter_pdfium_text(pdf):
+    for page in pdf:
+        textpage = page.get_textpage()
+        try:
+            yield textpage.get_text_range()
+        finally:
+            textpage.close()
+            page.close()
+
+def extract_pdf_text(file):
     try:
-        if file_type == "pdf":
-            with pdfplumber.open(file) as pdf:
-                text = "\n".join([p.extract_text() or "" for p in pdf.pages])
-        elif file_type == "pptx":
-            prs = pptx.Presentation(file)
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape, "text"):
-                        text += shape.text + "\n"
-    except Exception:
-        return None
-    return text
+        return extract_pdf_text_pdfium(file)
+    except Exception as e:
+        # Logged so a broken pypdfium2 install doesn't quietly send every
+        # upload down the slow path
+        logger.warning("PDFium could not read the PDF, falling back to pdfplumber: %r", e)
+        file.seek(0)
+    return extract_pdf_text_plumber(file)
+
+# Fallback for PDFs PDFium can't read, or when it isn't installed. Parsed in
+# this process, one page after another: forking the multi-threaded server
+# (Streamlit, gRPC, the event loop) for a worker pool can deadlock the child,
+# and a fallback path doesn't earn that risk.
+def extract_pdf_text_plumber(file):
+    import pdfplumber
+    with pdfplumber.open(file) as pdf:
+        return join_until_limit(p.extract_text() or "" for p in pdf.pages)
+
+def iter_shape_text(prs):
+    for slide in prs.slides:
+        for shape in slide.shapes:
+            if not shape.has_text_frame:
+                continue
+            # Per paragraph rather than shape.text, which builds a joined
+            # string we'd only split up again. paragraph.text, unlike its
+            # runs, keeps line breaks (as "\v") and field text such as dates.
+            for paragraph in shape.text_frame.paragraphs:
+                t = paragraph.text
+                if t:
+                    yield t
 
-def clean_json_response(response_text):
-    text = re.sub(r'```json\n?', '', response_text)
-    text = re.sub(r'```', '', text)
-    return text.strip()
+def extract_text(file, file_type):
+    if file_type == "pdf":
+        return extract_pdf_text(file)
+    if file_type == "pptx":
+        import pptx
+        prs = pptx.Presentation(file)
+        return join_until_limit(iter_shape_text(prs))
+    return ""
+
+# What the parsers raise for a file they can't read (encrypted, corrupt,
+# renamed). Both also hit plain KeyError/TypeError/ValueError on malformed
+# input, which for the same bytes fails the same way every time. Anything
+# else, e.g. MemoryError, says nothing about the file.
+def parser_errors(file_type):
+    if file_type == "pdf":
+        from pdfminer.psparser import PSException
+        # pdfminer often trips over a missing or mistyped object
+        errors = (PSException, KeyError, TypeError)
+        try:
+            # pdfplumber >= 0.11 wraps pdfminer's errors in its own
+            from pdfplumber.utils.exceptions import MalformedPDFException, PdfminerException
+            errors += (MalformedPDFException, PdfminerException)
+        except ImportError:
+            pass
+        return errors
+    if file_type == "pptx":
+        from lxml.etree import XMLSyntaxError
+        from pptx.exc import PythonPptxError
+        # ValueError: "is not a PowerPoint file", e.g. a renamed .docx;
+        # KeyError: a zip without the package parts
+        return (PythonPptxError, zipfile.BadZipFile, XMLSyntaxError, ValueError, KeyError)
+    return ()
+
+# Keyed on the raw upload bytes, so re-uploads and reruns skip the parse.
+# Returns (text, error). An unreadable file comes back as a value rather than
+# an exception so st.cache_data keeps it too, and clicking Run again on the
+# same broken file reports it without re-parsing. Other errors propagate and
+# aren't cached, so a transient failure doesn't mark a good deck unreadable.
+@st.cache_data(show_spinner=False)
+def extract_text_cached(file_bytes, file_type):
+    try:
+        return extract_text(io.BytesIO(file_bytes), file_type), None
+    except parser_errors(file_type) as e:
+        logger.warning("Could not extract text from %s upload: %r", file_type, e)
+        return None, f"{type(e).__name__}: {e}"
 
 def generate_google_link(query):
     encoded = urllib.parse.quote(query)
     return f"https://www.google.com/search?q={encoded}"
 
-# --- 4. AGENT 1: THE JUDGE ---
-def analyze_pitch(deck_text):
-    prompt = f"""
-    You are a strict Judge for the 'Eureka' Pitch Competition.
-    
-    TASK: Score the uploaded pitch deck based on the RUBRIC below.
+def hash_bytes(data):
+    return hashlib.blake2b(data).hexdigest()
+
+# --- 4. GEMINI CALLS ---
+# Approved models, in order of preference
+MODEL_OPTIONS = ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-1.5-pro", "gemini-1.5-flash"]
+
+@st.cache_resource
+def get_event_loop():
+    # The async Gemini client binds to the first loop it runs on, so every
+    # session submits its coroutines to one long-lived loop on its own thread.
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+# Requests in flight across every session, so a few cohorts submitted at
+# once still stay under the key's QPM
+MAX_IN_FLIGHT = 20
+
+@st.cache_resource
+def get_request_semaphore():
+    # Built on the shared loop, which is the only one that ever awaits it
+    async def make_semaphore():
+        return asyncio.Semaphore(MAX_IN_FLIGHT)
+    return asyncio.run_coroutine_threadsafe(make_semaphore(), get_event_loop()).result()
+
+# Judge and Teacher answer in one call, so the schema covers both
+class Review(TypedDict):
+    question: str
+    score: int
+    reasoning: str
+
+class CaseStudy(TypedDict):
+    weakness: str
+    example_company: str
+    lesson: str
+    search_query: str
+
+class Report(TypedDict):
+    reviews: list[Review]
+    total_score: int
+    hard_truth: str
+    case_studies: list[CaseStudy]
+
+# The same shape as a JSON Schema, compiled once into a Python validator so
+# a malformed report is caught before caching and before the UI indexes it
+CASE_STUDY_FIELDS = ["weakness", "example_company", "lesson", "search_query"]
+
+REPORT_JSON_SCHEMA = {
+    "type": "object",
+    "required": ["reviews", "total_score", "hard_truth", "case_studies"],
+    "properties": {
+        "reviews": {"type": "array", "items": {
+            "type": "object",
+            "required": ["question", "score", "reasoning"],
+            "properties": {
+                "question": {"type": "string"},
+                "score": {"type": "integer", "minimum": 1, "maximum": 3},
+                "reasoning": {"type": "string"},
+            },
+        }},
+        "total_score": {"type": "integer"},
+        "hard_truth": {"type": "string"},
+        "case_studies": {"type": "array", "items": {
+            "type": "object",
+            "required": CASE_STUDY_FIELDS,
+            "properties": {field: {"type": "string"} for field in CASE_STUDY_FIELDS},
+        }},
+    },
+}
+validate_report = fastjsonschema.compile(REPORT_JSON_SCHEMA)
+# Part of every cache key, so tightening the schema retires reports that
+# were only valid under the old one
+REPORT_SCHEMA_TEXT = json.dumps(REPORT_JSON_SCHEMA, sort_keys=True)
+
+# The static Judge prompt can be uploaded once as an explicit context cache,
+# so each call only sends the deck and the prefix is billed at the cached
+# rate. The model is rebuilt a little before the cache expires.
+PROMPT_CACHE_TTL = datetime.timedelta(hours=1)
+# Explicit caches have a minimum size. At ~700 tokens JUDGE_PROMPT is under
+# it for every approved model today, so this only kicks in if the rubric
+# grows; until then implicit prefix caching is all we get.
+PROMPT_CACHE_MIN_TOKENS = {"models/gemini-2.5-flash": 1024}
+PROMPT_CACHE_MIN_TOKENS_DEFAULT = 32768
+# English runs about four characters a token; a local estimate is plenty to
+# tell ~700 from 1024 without a count_tokens round-trip on every rebuild
+CHARS_PER_TOKEN = 4
+
+def create_prompt_cache(name):
+    if len(JUDGE_PROMPT) // CHARS_PER_TOKEN < PROMPT_CACHE_MIN_TOKENS.get(name, PROMPT_CACHE_MIN_TOKENS_DEFAULT):
+        return None
+    try:
+        return genai.caching.CachedContent.create(model=name, display_name="eureka-judge-prompt",
+                                                  system_instruction=JUDGE_PROMPT, ttl=PROMPT_CACHE_TTL)
+    except Exception as e:
+        logger.info("No context cache for %s: %r", name, e)
+        return None
+
+@st.cache_resource(ttl=PROMPT_CACHE_TTL.total_seconds() - 300, show_spinner=False)
+def get_model(name):
+    generation_config = {"response_mime_type": "application/json", "response_schema": Report}
+    prompt_cache = create_prompt_cache(name)
+    if prompt_cache is not None:
+        return genai.GenerativeModel.from_cached_content(cached_content=prompt_cache, generation_config=generation_config)
+    return genai.GenerativeModel(name, generation_config=generation_config)
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def pick_model():
+    # One list_models() call per hour instead of a failed request per missing model
+    try:
+        served = {m.name for m in genai.list_models() if "generateContent" in m.supported_generation_methods}
+    except Exception as e:
+        logger.warning("Could not list Gemini models: %r", e)
+        raise RuntimeError("Could not list Gemini models") from e
+    for m in MODEL_OPTIONS:
+        if f"models/{m}" in served:
+            return f"models/{m}"
+    raise RuntimeError("None of the approved Gemini models are available")
+
+@st.cache_resource
+def get_last_model():
+    return {}
+
+def current_model_name():
+    # pick_model() needs Gemini up, but cached reports don't. During an
+    # outage, fall back to the last model we picked (or the preferred one)
+    # so lookups still hit; a miss then fails at the request as it would anyway.
+    last = get_last_model()
+    try:
+        last["name"] = pick_model()
+    except RuntimeError:
+        return last.get("name", f"models/{MODEL_OPTIONS[0]}")
+    return last["name"]
+
+# Timeouts and 503s are worth another try; quota, auth and bad-request
+# errors won't change on retry, so they fail on the first attempt.
+RETRYABLE_ERRORS = (google_exceptions.DeadlineExceeded, google_exceptions.ServiceUnavailable)
+
+@retry(retry=retry_if_exception_type(RETRYABLE_ERRORS), wait=wait_exponential(multiplier=0.5, max=4),
+       stop=stop_after_attempt(3), reraise=True)
+async def request_json(prompt, model, on_chunk=None):
+    if on_chunk is None:
+        response = await model.generate_content_async(prompt)
+        return response.text
+    # Stream so the UI can show the JSON while it is still being written.
+    # None tells the reader to drop whatever a failed attempt already sent.
+    on_chunk(None)
+    parts = []
+    async for chunk in await model.generate_content_async(prompt, stream=True):
+        parts.append(chunk.text)
+        on_chunk(chunk.text)
+    return "".join(parts)
+
+async def generate_json(prompt, model, on_chunk=None):
+    try:
+        return await request_json(prompt, model, on_chunk)
+    except Exception as e:
+        logger.warning("Gemini request to %s failed: %r", model.model_name, e)
+        raise RuntimeError("Gemini did not return a response") from e
+
+# --- 5. THE JUDGE & TEACHER ---
+# Everything above the deck is identical on every call, so Gemini's implicit
+# prefix cache can reuse it. Dedented once here so no indentation is billed.
+JUDGE_PROMPT = textwrap.dedent("""
+    You are a strict Judge for the 'Eureka' Pitch Competition, and a Startup Mentor to the team behind the deck.
+
+    TASK 1: Score the pitch deck at the end of this prompt based on the RUBRIC below.
     Use the "CASE STUDY ANCHORS" to determine if a score is 1 or 3.
 
-    INPUT PITCH DECK:
-    "{deck_text[:30000]}"
+    TASK 2: For EACH question you scored below 3, identify a famous successful startup (Airbnb, Dropbox, Uber, DoorDash, etc.) that solved this specific problem perfectly in their early pitch deck.
+    Set "weakness" to the question it fixes. Leave "case_studies" empty if every score is 3.
 
     RUBRIC QUESTIONS:
-    {RUBRIC_QUESTIONS}
+    {questions}
 
     CASE STUDY ANCHORS (STRICT RULES):
-    {RUBRIC_GUIDE}
+    {guide}
 
     OUTPUT FORMAT:
     Respond with VALID JSON ONLY:
     {{
-        "reviews": [
-            {{
-                "question": "1. What is the problem?",
-                "score": 1,
-                "reasoning": "The deck only states..."
-            }},
-            ...
-        ],
-        "total_score": 0,
-        "hard_truth": "Summary paragraph."
+      "reviews": [
+        {{
+          "question": "1. What is the problem?",
+          "score": 1,
+          "reasoning": "The deck only states..."
+        }},
+        ...
+      ],
+      "total_score": 0,
+      "hard_truth": "Summary paragraph.",
+      "case_studies": [
+        {{
+          "weakness": "6. Who is the customer/end user?",
+          "example_company": "Airbnb",
+          "lesson": "Airbnb didn't just say 'travelers'. They specifically targeted attendees of a design conference in SF when hotels were sold out.",
+          "search_query": "Airbnb pitch deck customer validation slide"
+        }}
+      ]
     }}
-    """
-    
-    # Try models in order (Using your approved list)
-    model_options = ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-1.5-pro", "gemini-1.5-flash"]
-    
-    for m in model_options:
+    ---
+    INPUT PITCH DECK:
+    """).lstrip().format(questions=RUBRIC_QUESTIONS.strip(), guide=RUBRIC_GUIDE.strip())
+
+def judge_prompt(deck_text):
+    return f'{JUDGE_PROMPT}"{deck_text}"\n'
+
+async def analyze_pitch(deck_text, model, on_chunk=None):
+    # A cache-backed model already holds JUDGE_PROMPT as its system instruction
+    prompt = f'"{deck_text}"\n' if getattr(model, "cached_content", None) else judge_prompt(deck_text)
+    async with get_request_semaphore():
+        return await generate_json(prompt, model, on_chunk)
+
+# --- 6. THE PIPELINE ---
+def load_report(raw_report):
+    # JsonSchemaException subclasses ValueError, like a parse error
+    return validate_report(parse_json(raw_report))
+
+# Returns (report, error), error being the reason for the UI
+def check_report(raw_report):
+    try:
+        return load_report(raw_report), None
+    except fastjsonschema.JsonSchemaException as e:
+        return None, f"didn't match the report format ({e.message})"
+    except ValueError:
+        return None, "couldn't be parsed"
+
+def weak_reviews(data):
+    return [r for r in data.get('reviews', []) if r['score'] < 3]
+
+def stream_report(deck_text, model, placeholder):
+    import pandas as pd
+    # Chunks arrive on the event loop thread; only the script thread may
+    # touch the page, so they are handed over through a queue. ijson's push
+    # parser picks each review out as soon as its closing brace arrives, and
+    # the table grows one row at a time instead of waiting for the whole report.
+    chunks = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(analyze_pitch(deck_text, model, chunks.put), get_event_loop())
+    rows, reviews, parser = [], None, None
+    while not (future.done() and chunks.empty()):
         try:
-            model = genai.GenerativeModel(m, generation_config={"response_mime_type": "application/json"})
-            return model.generate_content(prompt).text
-        except:
+            piece = chunks.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if piece is None:
+            # A new attempt starts from scratch
+            rows, reviews = [], ijson.sendable_list()
+            parser = ijson.items_coro(reviews, "reviews.item")
+            placeholder.empty()
+            continue
+        if parser is None:
+            continue
+        try:
+            parser.send(piece.encode("utf-8"))
+        except ijson.JSONError:
+            # Stop previewing; the full parse afterwards reports the problem
+            parser = None
+            continue
+        if reviews:
+            rows.extend(reviews)
+            del reviews[:]
+            placeholder.dataframe(pd.DataFrame(rows, columns=["question", "score", "reasoning"]), hide_index=True)
+    placeholder.empty()
+    return future.result()
+
+# Reports are keyed on the model, the report schema and the full prompt
+# (rubric and trimmed deck), so a model switch or a JUDGE_PROMPT or schema
+# edit never serves a stale one.
+def report_key(deck_text, model_name):
+    # Fed piece by piece rather than joined, so no throwaway copy of the
+    # ~30 KB prompt is built just to key it
+    h = hashlib.blake2b()
+    for part in (f"{model_name}\n", REPORT_SCHEMA_TEXT, JUDGE_PROMPT, '"', deck_text, '"\n'):
+        h.update(part.encode("utf-8"))
+    return h.hexdigest()
+
+# key -> (saved_at, raw_report), shared by every session. A plain store
+# rather than st.cache_data, which can't stream into the page.
+EVALUATION_TTL = 3600
+EVALUATION_MAX_ENTRIES = 512
+
+@st.cache_resource
+def get_evaluation_cache():
+    return {}
+
+# Sessions write to it from their own threads; eviction iterates it
+@st.cache_resource
+def get_evaluation_lock():
+    return threading.Lock()
+
+# Under that, raw reports on disk, so they survive a container restart
+DISK_CACHE_DIR = "/tmp/eureka_llm_cache"
+DISK_CACHE_TTL = 7 * 86400
+
+@st.cache_resource
+def get_disk_cache():
+    return Cache(DISK_CACHE_DIR)
+
+def remember_report(key, result):
+    cache = get_evaluation_cache()
+    with get_evaluation_lock():
+        cache[key] = (time.time(), result)
+        # Dicts keep insertion order, so the first key is the oldest entry
+        while len(cache) > EVALUATION_MAX_ENTRIES:
+            cache.pop(next(iter(cache)), None)
+
+def cached_report(key):
+    hit = get_evaluation_cache().get(key)
+    if hit and time.time() - hit[0] < EVALUATION_TTL:
+        return hit[1]
+    result = get_disk_cache().get(key)
+    if result is not None:
+        remember_report(key, result)
+    return result
+
+def store_report(key, result):
+    get_disk_cache().set(key, result, expire=DISK_CACHE_TTL)
+    remember_report(key, result)
+
+# Last tier: near-duplicate decks (re-exports, typo fixes) that would score
+# the same. Opt-in, since sentence-transformers and faiss are heavy installs.
+# Entries carry a fingerprint of the model, schema and JUDGE_PROMPT, so as
+# with report_key a prompt edit never matches a report written under the old one.
+SEMANTIC_CACHE_DIR = "./.semcache"
+SEMANTIC_THRESHOLD = 0.97
+# MiniLM only reads ~256 word pieces, so long decks are embedded in windows
+# and averaged rather than judged by their opening slides alone
+EMBED_WINDOW_WORDS = 200
+
+def prompt_fingerprint(model_name):
+    return hashlib.blake2b(f"{model_name}\n{REPORT_SCHEMA_TEXT}{JUDGE_PROMPT}".encode("utf-8")).hexdigest()
+
+class SemanticCache:
+    def __init__(self, embedder, faiss):
+        self.embedder = embedder
+        self.faiss = faiss
+        self.lock = threading.Lock()
+        os.makedirs(SEMANTIC_CACHE_DIR, exist_ok=True)
+        self.index_path = os.path.join(SEMANTIC_CACHE_DIR, "index.faiss")
+        self.responses_path = os.path.join(SEMANTIC_CACHE_DIR, "responses.jsonl")
+        self.entries = self.read_entries()
+        self.index = None
+        if os.path.exists(self.index_path):
             try:
-                # Retry with 'models/' prefix if needed
-                model = genai.GenerativeModel(f"models/{m}", generation_config={"response_mime_type": "application/json"})
-                return model.generate_content(prompt).text
-            except:
-                continue
-    return None
+                self.index = faiss.read_index(self.index_path)
+            except RuntimeError as e:
+                logger.warning("Semantic cache index is unreadable, rebuilding: %r", e)
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(embedder.get_sentence_embedding_dimension())
+        if self.index.ntotal != len(self.entries):
+            # The two files got out of step (e.g. a crash mid-write); start over
+            self.index.reset()
+            self.entries = []
+        # Rewritten either way, which also drops a line a crash cut short
+        self.write_entries()
 
-# --- 5. AGENT 2: THE TEACHER ---
-def get_case_studies(weak_areas_list):
-    weaknesses_str = "\n".join([f"- {w['question']} (Score: {w['score']})" for w in weak_areas_list])
-    
-    prompt = f"""
-    You are a Startup Mentor. The user has failed the following areas in their pitch:
-    {weaknesses_str}
-    
-    TASK:
-    For EACH weakness, identify a famous successful startup (Airbnb, Dropbox, Uber, DoorDash, etc.) that solved this specific problem perfectly in their early pitch deck.
-    
-    OUTPUT FORMAT (JSON):
-    {{
-        "case_studies": [
-            {{
-                "weakness": "Customer Discovery",
-                "example_company": "Airbnb",
-                "lesson": "Airbnb didn't just say 'travelers'. They specifically targeted attendees of a design conference in SF when hotels were sold out.",
-                "search_query": "Airbnb pitch deck customer validation slide" 
-            }}
-        ]
-    }}
-    """
-    
-    # FIXED: Loop through approved models
-    model_options = ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-1.5-pro", "gemini-1.5-flash"]
-    
-    for m in model_options:
+    def read_entries(self):
+        entries = []
+        if os.path.exists(self.responses_path):
+            with open(self.responses_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(parse_json(line))
+                    except ValueError:
+                        # add() appends the line before it saves the index,
+                        # so a torn line is the one the index never got
+                        logger.warning("Dropping a truncated semantic cache entry")
+                        break
+        return entries
+
+    def write_entries(self):
+        with open(self.responses_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in self.entries)
+
+    def embed(self, deck_text):
+        words = deck_text.split()
+        windows = [" ".join(words[i:i + EMBED_WINDOW_WORDS]) for i in range(0, len(words), EMBED_WINDOW_WORDS)]
+        vectors = self.embedder.encode(windows or [""], normalize_embeddings=True)
+        mean = vectors.mean(axis=0)
+        return (mean / max(float((mean ** 2).sum()) ** 0.5, 1e-12)).astype("float32")[None]
+
+    def lookup(self, embedding, prompt_id):
+        with self.lock:
+            if not self.index.ntotal:
+                return None
+            scores, ids = self.index.search(embedding, min(5, self.index.ntotal))
+            for score, i in zip(scores[0], ids[0]):
+                if score >= SEMANTIC_THRESHOLD and self.entries[i].get("prompt") == prompt_id:
+                    return self.entries[i]["report"]
+        return None
+
+    def add(self, embedding, prompt_id, report):
+        with self.lock:
+            self.index.add(embedding)
+            self.entries.append({"prompt": prompt_id, "report": report})
+            with open(self.responses_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.entries[-1]) + "\n")
+            self.faiss.write_index(self.index, self.index_path)
+
+@st.cache_resource
+def get_semantic_cache():
+    try:
+        import faiss
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        return None
+    # It's only a cache: if the model download or the files fail, run
+    # without it rather than fail every evaluation
+    try:
+        return SemanticCache(SentenceTransformer("all-MiniLM-L6-v2"), faiss)
+    except Exception as e:
+        logger.warning("Semantic cache disabled: %r", e)
+        return None
+
+# A cohort of decks goes out at once; analyze_pitch holds back any past
+# MAX_IN_FLIGHT
+async def analyze_many(deck_texts, model):
+    async def analyze_one(deck_text):
         try:
-            model = genai.GenerativeModel(m, generation_config={"response_mime_type": "application/json"})
-            return model.generate_content(prompt).text
-        except:
-             try:
-                model = genai.GenerativeModel(f"models/{m}", generation_config={"response_mime_type": "application/json"})
-                return model.generate_content(prompt).text
-             except:
-                continue
-    return None
+            return await analyze_pitch(deck_text, model)
+        except RuntimeError:
+            return None
+
+    return await asyncio.gather(*(analyze_one(t) for t in deck_texts))
+
+# Trim the deck to a token budget rather than a char count, so dense and
+# sparse decks both fill the same share of the context. cl100k isn't Gemini's
+# tokenizer, but it's a close enough proxy and fast (Rust).
+DECK_TOKEN_LIMIT = 7500
+DECK_CHAR_LIMIT = 30000
+
+@st.cache_resource
+def get_tokenizer():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    # A failed download of the encoding file raises, so st.cache_resource
+    # doesn't keep it and the next deck tries again
+    return tiktoken.get_encoding("cl100k_base")
 
-# --- 6. THE UI ---
+# Runs of blank lines and spaces from the extractors carry no meaning for
+# the Judge, and collapsing them lets re-exports of the same deck share a
+# key. Single line breaks stay: they separate slides, bullets and titles.
+LINE_BREAKS = re.compile(r'\s*[\n\r\v]\s*')
+SPACES = re.compile(r'[^\S\n]+')
+
+def trim_deck(deck_text):
+    deck_text = SPACES.sub(" ", LINE_BREAKS.sub("\n", deck_text))
+    try:
+        enc = get_tokenizer()
+    except Exception as e:
+        logger.warning("Could not load the cl100k tokenizer, trimming by characters: %r", e)
+        enc = None
+    if enc is None:
+        return deck_text[:DECK_CHAR_LIMIT].strip()
+    tokens = enc.encode(deck_text, disallowed_special=())
+    if len(tokens) <= DECK_TOKEN_LIMIT:
+        return deck_text.strip()
+    return enc.decode(tokens[:DECK_TOKEN_LIMIT]).strip()
+
+# Returns a (report, error) pair per deck, like check_report; (None, None)
+# means Gemini gave no answer at all
+def evaluate_pitches(deck_texts, placeholder):
+    # Only the trimmed text reaches the prompt, so that's all we key on
+    deck_texts = [trim_deck(t) for t in deck_texts]
+    model_name = current_model_name()
+    keys = [report_key(t, model_name) for t in deck_texts]
+    results = [cached_report(k) for k in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    semantic = get_semantic_cache()
+    embeddings = {}
+    if semantic is not None:
+        prompt_id = prompt_fingerprint(model_name)
+        for i in missing:
+            embeddings[i] = semantic.embed(deck_texts[i])
+            results[i] = semantic.lookup(embeddings[i], prompt_id)
+            if results[i] is not None:
+                remember_report(keys[i], results[i])
+        missing = [i for i in missing if results[i] is None]
+    fresh = [None] * len(missing)
+    if missing:
+        try:
+            model = get_model(model_name)
+            if len(missing) == 1:
+                # A single deck streams into the page; a batch has nowhere to stream to
+                fresh = [stream_report(deck_texts[missing[0]], model, placeholder)]
+            else:
+                fresh = asyncio.run_coroutine_threadsafe(
+                    analyze_many([deck_texts[i] for i in missing], model), get_event_loop()).result()
+        except RuntimeError:
+            pass
+    for i, result in zip(missing, fresh):
+        results[i] = result
+    # Each report is parsed and validated exactly once, here
+    reports = [(None, None) if result is None else check_report(result) for result in results]
+    for i in missing:
+        report, error = reports[i]
+        if error:
+            # Hand it back so the UI can say what's wrong, but don't keep it
+            logger.warning("Discarding malformed report: %s", error)
+        elif report is not None:
+            store_report(keys[i], results[i])
+            if semantic is not None:
+                semantic.add(embeddings[i], prompt_id, results[i])
+    return reports
+
+# --- 7. THE UI ---
 st.title("EUREKA! Pitch Scorer & Coach")
 
 if "analysis_data" not in st.session_state:
     st.session_state["analysis_data"] = None
+    # file hash -> analysis_data, so reruns never re-judge a deck
+    st.session_state["results_by_hash"] = {}
 
-uploaded_file = st.file_uploader("Upload Pitch Deck", type=["pdf", "pptx"])
+uploaded_files = st.file_uploader("Upload Pitch Decks", type=["pdf", "pptx"], accept_multiple_files=True)
+results_by_hash = st.session_state["results_by_hash"]
+file_hashes = [hash_bytes(f.getvalue()) for f in uploaded_files]
+pending = [(f, h) for f, h in zip(uploaded_files, file_hashes) if h not in results_by_hash]
 
-if uploaded_file and st.button("Run Evaluation"):
-    with st.spinner("Reading file..."):
-        ftype = uploaded_file.name.split(".")[-1].lower()
-        extracted_text = extract_text(uploaded_file, ftype)
+if uploaded_files and st.button("Run Evaluation") and pending:
+    with st.spinner("Reading files..."):
+        decks = []
+        for f, h in pending:
+            ftype = f.name.split(".")[-1].lower()
+            try:
+                extracted_text, error = extract_text_cached(f.getvalue(), ftype)
+            except Exception as e:
+                logger.exception("Extracting text from %s failed", f.name)
+                st.error(f"Could not read {f.name} right now ({type(e).__name__}). Please try again.")
+                continue
+            if extracted_text:
+                decks.append((f.name, h, extracted_text))
+            elif error:
+                st.error(f"Could not read {f.name} ({error}).")
+            else:
+                st.warning(f"No text found in {f.name}. Scanned or image-only decks can't be judged.")
         
-    if extracted_text:
+    if decks:
         with st.spinner("Judging..."):
-            raw_result = analyze_pitch(extracted_text)
-            if raw_result:
-                try:
-                    st.session_state["analysis_data"] = json.loads(clean_json_response(raw_result))
-                except:
-                    st.error("Error parsing AI response. Please try again.")
+            reports = evaluate_pitches([text for _, _, text in decks], st.empty())
+            for (name, h, _), (report, error) in zip(decks, reports):
+                if report is not None:
+                    results_by_hash[h] = report
+                elif error:
+                    # response_schema makes the output bare JSON; only a cut-off
+                    # stream or a dropped field can still get past it
+                    st.error(f"AI response for {name} {error}. Please try again.")
+                else:
+                    st.error(f"Could not get an evaluation for {name}. Gemini may be unavailable, please try again.")
+
+judged = [(f.name, h) for f, h in zip(uploaded_files, file_hashes) if h in results_by_hash]
+if judged:
+    choice = 0
+    if len(judged) > 1:
+        choice = st.selectbox("Show report for", range(len(judged)), format_func=lambda i: judged[i][0])
+    st.session_state["analysis_data"] = results_by_hash[judged[choice][1]]
 
 # --- DISPLAY RESULTS ---
 if st.session_state["analysis_data"]:
@@ -226,28 +799,22 @@ if st.session_state["analysis_data"]:
                 st.divider()
 
     # --- REMEDIATION SECTION ---
-    weak_points = [r for r in data.get('reviews', []) if r['score'] < 3]
+    weak_points = weak_reviews(data)
     
     if weak_points:
         st.header("Case Study Remediation")
         st.info(f"We found {len(weak_points)} areas for improvement. Click below to see how unicorn companies solved these specific problems.")
         
         if st.button("Find Case Studies for My Weaknesses"):
-            with st.spinner("Searching for similar business cases..."):
-                remedy_raw = get_case_studies(weak_points)
-                
-                if remedy_raw:
-                    try:
-                        remedy_data = json.loads(clean_json_response(remedy_raw))
-                        
-                        for study in remedy_data.get('case_studies', []):
-                            with st.expander(f"Fixing: {study['weakness']} (Example: {study['example_company']})", expanded=True):
-                                st.markdown(f"**The Lesson:** {study['lesson']}")
-                                link = generate_google_link(study['search_query'])
-                                st.markdown(f"**[Click to see the real slide on Google]({link})**")
-                                st.caption(f"Search Query: '{study['search_query']}'")
-                                
-                    except Exception as e:
-                        st.error(f"Could not load case studies. Error: {e}")
-                else:
-                    st.error("Could not connect to AI models for case studies.")
+            # Written by the same call as the report card, so there is nothing left to fetch
+            studies = data.get('case_studies', [])
+            
+            for study in studies:
+                with st.expander(f"Fixing: {study['weakness']} (Example: {study['example_company']})", expanded=True):
+                    st.markdown(f"**The Lesson:** {study['lesson']}")
+                    link = generate_google_link(study['search_query'])
+                    st.markdown(f"**[Click to see the real slide on Google]({link})**")
+                    st.caption(f"Search Query: '{study['search_query']}'")
+            
+            if not studies:
+                st.error("No case studies came back with this evaluation.")